@@ -63,8 +63,8 @@ def set(obj, key, value):
     api = lib.get_api(**obj)
     value = lib.parse(value, "json")
     api.set_config(key, value)
-    new_value = api.get_config(key)
-    lib.log_output(f"Configuration entry {key} has been set to {new_value}")
+    # The server either stored the value as given or raised, so no need to fetch it.
+    lib.log_output(f"Configuration entry {key} has been set to {value}")
 
 
 @main.command()
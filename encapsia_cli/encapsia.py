@@ -1,21 +1,10 @@
+import importlib
 import pathlib
 
 import click
 import click_completion
 
-import encapsia_cli.completion
-import encapsia_cli.config
-import encapsia_cli.database
-import encapsia_cli.fixtures
-import encapsia_cli.help
-import encapsia_cli.httpie
-import encapsia_cli.plugins
-import encapsia_cli.run
-import encapsia_cli.schedule
-import encapsia_cli.shell
-import encapsia_cli.token
-import encapsia_cli.users
-import encapsia_cli.version
+import encapsia_cli
 from encapsia_cli import lib
 
 
@@ -23,9 +12,10 @@ from encapsia_cli import lib
 click_completion.init()
 
 
-DEFAULT_CONFIG_FILE = f"""
+#: Template for the default config file, only formatted when it needs creating.
+DEFAULT_CONFIG_FILE_TEMPLATE = """
 # Encapsia CLI config file
-# Automatically created by encapsia-cli=={encapsia_cli.__version__}
+# Automatically created by encapsia-cli=={version}
 
 # Unlikely to want to fix the host here, but you can.
 # host = "localhost"
@@ -53,17 +43,32 @@ s3_buckets = [
 """.strip()
 
 
+#: Config files already known to exist, so need no further checks.
+_CHECKED_CONFIG_FILES = set()
+
+
 def create_default_config_file_if_needed(filename):
+    if filename in _CHECKED_CONFIG_FILES:
+        return
     filename.parent.mkdir(parents=True, exist_ok=True)
     if not filename.exists():
-        with filename.open("w") as f:
-            f.write(DEFAULT_CONFIG_FILE)
+        filename.write_text(
+            DEFAULT_CONFIG_FILE_TEMPLATE.format(version=encapsia_cli.__version__)
+        )
         lib.log(f"Created default user configuration file in: {str(filename)}")
+    _CHECKED_CONFIG_FILES.add(filename)
+
+
+#: Parsed user config, keyed by (filename, mtime) so that edits are picked up.
+_USER_CONFIG_CACHE = {}
 
 
 def get_user_config():
     filename = pathlib.Path.home() / ".encapsia" / "config.toml"
     create_default_config_file_if_needed(filename)
+    key = (filename, filename.stat().st_mtime_ns)
+    if key in _USER_CONFIG_CACHE:
+        return _USER_CONFIG_CACHE[key]
     config = lib.read_toml(filename)
 
     # Make directories into Path directories which exist.
@@ -71,10 +76,93 @@ def get_user_config():
         config[k][d] = pathlib.Path(config[k][d]).expanduser()
         config[k][d].mkdir(parents=True, exist_ok=True)
 
+    _USER_CONFIG_CACHE.clear()
+    _USER_CONFIG_CACHE[key] = config
     return config
 
 
-@click.group(context_settings=dict(default_map=get_user_config()))
+#: Subcommand names, the modules defining them (as `main`) and their short help. The
+#: modules are only imported when the subcommand is actually used, to keep startup
+#: fast, and the short help lets `--help` and completion list them without importing.
+COMMANDS = {
+    "completion": ("encapsia_cli.completion", "Manage shell completions."),
+    "config": ("encapsia_cli.config", "Get/set server configuration."),
+    "database": ("encapsia_cli.database", "Backups and Restore encapsia databases."),
+    "fixtures": ("encapsia_cli.fixtures", "Manage database fixtures."),
+    "help": ("encapsia_cli.help", "Print longer help information about the CLI."),
+    "httpie": (
+        "encapsia_cli.httpie",
+        "Launch an httpie interactive shell with passed-in credentials.",
+    ),
+    "plugins": (
+        "encapsia_cli.plugins",
+        "Install, uninstall, create, and update plugins.",
+    ),
+    "run": ("encapsia_cli.run", "Run an Encapsia task, job, or view."),
+    "schedule": ("encapsia_cli.schedule", "Manage task schedules."),
+    "shell": (
+        "encapsia_cli.shell",
+        "Start an interactive shell for running the encapsia commands.",
+    ),
+    "token": ("encapsia_cli.token", "Do things with an encapsia token."),
+    "users": (
+        "encapsia_cli.users",
+        "Manage users, including superuser and system users.",
+    ),
+    "version": ("encapsia_cli.version", "Print version information and exit."),
+}
+
+
+class EncapsiaCli(click.Group):
+    """Top level group which imports its subcommand modules on first use."""
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = dict(lazy_commands or {})
+        self._sorted_commands = None
+
+    def add_command(self, cmd, name=None):
+        super().add_command(cmd, name=name)
+        self._sorted_commands = None
+
+    def list_commands(self, ctx):
+        if self._sorted_commands is None:
+            self._sorted_commands = tuple(sorted({*self.commands, *self.lazy_commands}))
+        return self._sorted_commands
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            module_name, _ = self.lazy_commands[name]
+            self.commands[name] = importlib.import_module(module_name).main
+        return self.commands.get(name)
+
+    def get_command_short_help(self, ctx, name, limit=45):
+        if name not in self.commands and name in self.lazy_commands:
+            _, short_help = self.lazy_commands[name]
+            return click.utils.make_default_short_help(short_help, limit)
+        return self.get_command(ctx, name).get_short_help_str(limit)
+
+    def format_commands(self, ctx, formatter):
+        """Like click's, but using the short help so as not to import every module."""
+        names = [
+            name
+            for name in self.list_commands(ctx)
+            if name not in self.commands or not self.commands[name].hidden
+        ]
+        if names:
+            limit = formatter.width - 6 - max(len(name) for name in names)
+            rows = [
+                (name, self.get_command_short_help(ctx, name, limit)) for name in names
+            ]
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
+
+
+@click.group(
+    cls=EncapsiaCli,
+    lazy_commands=COMMANDS,
+    context_settings=dict(default_map=get_user_config()),
+)
 @click.option(
     "--colour",
     type=click.Choice(["always", "never", "auto"]),
@@ -124,25 +212,5 @@ def main(ctx, colour, host, silent):
     ctx.obj = dict(host=host, silent=silent)
 
 
-COMMANDS = [
-    encapsia_cli.completion.main,
-    encapsia_cli.config.main,
-    encapsia_cli.database.main,
-    encapsia_cli.fixtures.main,
-    encapsia_cli.help.main,
-    encapsia_cli.httpie.main,
-    encapsia_cli.plugins.main,
-    encapsia_cli.run.main,
-    encapsia_cli.schedule.main,
-    encapsia_cli.shell.main,
-    encapsia_cli.token.main,
-    encapsia_cli.users.main,
-    encapsia_cli.version.main,
-]
-
-for command in COMMANDS:
-    main.add_command(command)
-
-
 def encapsia():
     main(auto_envvar_prefix="ENCAPSIA")
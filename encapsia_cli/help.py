@@ -12,19 +12,17 @@ def main(ctx, command):
     if command:
         lib.log(root_command.get_command(ctx, command).get_help(ctx))
     else:
-        lib.log(root_command.get_help(ctx))
-        lib.log()
-        lib.log("Subcommands:")
-        long_list = []
+        rows = []
+        width = 0
         for name in root_command.list_commands(ctx):
             command = root_command.get_command(ctx, name)
             if isinstance(command, click.Group):
                 for subname in command.list_commands(ctx):
                     subcommand = command.get_command(ctx, subname)
-                    help_str = subcommand.get_short_help_str()
-                    long_list.append((name, subname, help_str))
-        width = max(len(name) + len(subname) for (name, subname, _) in long_list)
-        for name, subname, help_str in long_list:
-            left = f"{name} {subname}"
-            left = left + " " * (width + 2 - len(left))
-            lib.log(f"  {left} {help_str}")
+                    left = f"{name} {subname}"
+                    width = max(width, len(left))
+                    rows.append((left, subcommand.get_short_help_str()))
+        # Build the whole listing up front so it is written out in one go.
+        lines = [root_command.get_help(ctx), "", "Subcommands:"]
+        lines.extend(f"  {left:<{width + 1}} {help_str}" for left, help_str in rows)
+        lib.log("\n".join(lines))
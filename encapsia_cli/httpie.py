@@ -1,4 +1,6 @@
-import importlib
+import os
+import shlex
+import shutil
 import subprocess
 
 import click
@@ -7,13 +9,15 @@ from encapsia_cli import lib
 
 
 @click.command("httpie")
+@click.option(
+    "--print",
+    "print_only",
+    is_flag=True,
+    help="Print the http-prompt command line instead of running it.",
+)
 @click.pass_obj
-def main(obj):
+def main(obj, print_only):
     """Launch an httpie interactive shell with passed-in credentials."""
-    try:
-        importlib.import_module("http_prompt")
-    except ModuleNotFoundError:
-        lib.log_error("Please install http-prompt first.", abort=True)
     api = lib.get_api(**obj)
     argv = [
         "http-prompt",
@@ -21,4 +25,13 @@ def main(obj):
         f"Authorization: Bearer {api.token}",
         "Accept: application/json",
     ]
-    subprocess.run(argv)
+    if print_only:
+        click.echo(shlex.join(argv))
+        return
+    if shutil.which("http-prompt") is None:
+        lib.log_error("Please install http-prompt first.", abort=True)
+    if obj.get("interactive_shell"):
+        # Return to the encapsia shell once http-prompt exits.
+        subprocess.run(argv)
+    else:
+        os.execvp(argv[0], argv)
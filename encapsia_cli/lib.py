@@ -1,41 +1,59 @@
 import contextlib
 import datetime
+import functools
 import io
 import json
+import os
 import pathlib
 import re
+import shlex
 import shutil
-import subprocess
-import tarfile
 import tempfile
 import time
 
 import click
-import encapsia_api
-import requests.exceptions
-import shellingham  # type: ignore
-import toml
 
 
+#: Templates for setting an environment variable; `value` must already be quoted.
 SHELL_SET_ENV_TEMPLATES = {
-    "bash": "export {variable}='{value}'",
-    "zsh": "export {variable}='{value}'",
-    "fish": "set -xU {variable} '{value}'",
+    "bash": "export {variable}={value}",
+    "zsh": "export {variable}={value}",
+    "fish": "set -xU {variable} {value}",
 }
 
 
-def _get_shell_setenv_template(shell):
+def _fish_quote(value):
+    # Within fish's single quotes only backslash and single quote are special, and
+    # both are escaped with a backslash (unlike POSIX shells, see shlex.quote).
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+#: How to quote a value for each shell in SHELL_SET_ENV_TEMPLATES.
+SHELL_QUOTE_FUNCTIONS = {"bash": shlex.quote, "zsh": shlex.quote, "fish": _fish_quote}
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_shell():
+    """Return the name of the parent shell, which cannot change during the process."""
+    import shellingham  # type: ignore
+
+    try:
+        shell, _ = shellingham.detect_shell()
+    except shellingham.ShellDetectionFailure:
+        shell = "sh"
+    return shell
+
+
+def _get_shell_setenv(shell):
+    """Return (setenv template, quote function) for shell, which may be "auto"."""
     if shell == "auto":
         was_auto = " (auto-detected)"
-        try:
-            shell, _ = shellingham.detect_shell()
-        except shellingham.ShellDetectionFailure:
-            shell = "sh"
+        shell = _detect_shell()
     else:
         was_auto = ""
     if shell not in SHELL_SET_ENV_TEMPLATES:
         log_error(f"Unsupported shell: {shell}{was_auto}", abort=True)
-    return SHELL_SET_ENV_TEMPLATES[shell]
+    return SHELL_SET_ENV_TEMPLATES[shell], SHELL_QUOTE_FUNCTIONS[shell]
 
 
 def log(message="", nl=True):
@@ -54,11 +72,47 @@ def log_error(message="", abort=False):
         raise click.Abort()
 
 
+# The TOML libraries below are imported on first use, to keep them out of the
+# startup time of commands which never need them (e.g. --help).
+
+
+@functools.lru_cache(maxsize=None)
+def _get_toml_loads():
+    try:
+        import tomllib
+    except ModuleNotFoundError:  # Python < 3.11, so fall back to the toml package.
+        import toml as tomllib
+    return tomllib.loads
+
+
+def _format_json(obj):
+    return json.dumps(obj, sort_keys=True, indent=4).strip()
+
+
+def _format_toml(obj):
+    import toml
+
+    return toml.dumps(obj)
+
+
+def _parse_json(s):
+    return json.loads(s)
+
+
+def _parse_toml(s):
+    return _get_toml_loads()(s)
+
+
+#: Functions to format objects as, and parse objects from, each supported format.
+FORMATTERS = {"json": _format_json, "toml": _format_toml}
+PARSERS = {"json": _parse_json, "toml": _parse_toml}
+
+
 def pretty_print(obj, format, output=None):
-    if format == "json":
-        formatted = json.dumps(obj, sort_keys=True, indent=4).strip()
-    elif format == "toml":
-        formatted = toml.dumps(obj)
+    formatter = FORMATTERS.get(format)
+    if formatter is None:
+        raise ValueError(f"Unsupported format: {format}")
+    formatted = formatter(obj)
     if output is None:
         log_output(formatted)
     else:
@@ -71,16 +125,28 @@ def print_token(token, display, url=None, shell="auto"):
     elif display == "shell":
         if url is None:
             raise ValueError("Need an URL to print shell setenv commands")
-        setenv_template = _get_shell_setenv_template(shell)
-        log(setenv_template.format(variable="ENCAPSIA_URL", value=url))
-        log(setenv_template.format(variable="ENCAPSIA_TOKEN", value=token))
+        setenv_template, quote = _get_shell_setenv(shell)
+        for variable, value in (("ENCAPSIA_URL", url), ("ENCAPSIA_TOKEN", token)):
+            log(setenv_template.format(variable=variable, value=quote(value)))
 
     else:
         raise ValueError(f"Unsupported display format {display}")
 
 
 def get_api(**obj):
+    """Return an EncapsiaApi for the host, reusing the one stored in ctx.obj["api"].
+
+    The shared ctx.obj outlives a single subcommand (e.g. in `encapsia shell`), so
+    use `forget_api` after changing the credentials for a host.
+
+    """
+    import encapsia_api
+
     host = obj.get("host")
+    ctx = click.get_current_context(silent=True)
+    ctx_obj = ctx.obj if ctx is not None and ctx.obj is not None else {}
+    if "api" in ctx_obj and ctx_obj.get("api_host") == host:
+        return ctx_obj["api"]
     try:
         url, token = encapsia_api.discover_credentials(host)
     except encapsia_api.EncapsiaApiError as e:
@@ -90,7 +156,27 @@ def get_api(**obj):
             "or ~/.encapsia/config.toml file."
         )
         log_error(str(e), abort=True)
-    return encapsia_api.EncapsiaApi(url, token)
+    api = encapsia_api.EncapsiaApi(url, token)
+    ctx_obj["api"], ctx_obj["api_host"] = api, host
+    return api
+
+
+@functools.lru_cache(maxsize=None)
+def get_credentials_store():
+    """Return a CredentialsStore shared by the whole process.
+
+    The store re-reads ~/.encapsia/credentials.toml only when it has been modified.
+
+    """
+    from encapsia_api import CredentialsStore
+
+    return CredentialsStore()
+
+
+def forget_api(obj):
+    """Drop the EncapsiaApi stored by `get_api` so the next call rediscovers it."""
+    obj.pop("api", None)
+    obj.pop("api_host", None)
 
 
 def add_docstring(value):
@@ -104,11 +190,21 @@ def add_docstring(value):
 
 
 # See http://www.regular-expressions.info/email.html
-EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+# Left uncompiled so only commands which validate emails pay for compiling it; after
+# the first use `re` serves the compiled pattern from its own cache.
+EMAIL_REGEX = r"\A[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\Z"
+
+
+@functools.lru_cache(maxsize=1024)
+def _is_valid_email(value):
+    # Cheap rejection of obviously invalid input before using the regex.
+    if "@" not in value or "." not in value.rsplit("@", 1)[-1]:
+        return False
+    return re.match(EMAIL_REGEX, value, re.ASCII) is not None
 
 
 def validate_email(ctx, param, value):
-    if not EMAIL_REGEX.match(value):
+    if not _is_valid_email(value):
         raise click.BadParameter("Not a valid email address")
     return value
 
@@ -132,40 +228,147 @@ def temp_directory():
 
 
 def most_recently_modified(directory):
-    """Return datetime of most recently changed file in directory."""
-    files = list(directory.glob("**/*.*"))
-    if files:
-        return datetime.datetime.utcfromtimestamp(max(t.stat().st_mtime for t in files))
-    else:
+    """Return datetime of most recently changed file in directory.
+
+    As with `directory.glob("**/*.*")`, only names containing a dot are considered,
+    symlinked directories are not descended into and unreadable ones are skipped.
+    Walks the tree in a single pass with `os.scandir`, rather than building a list of
+    paths and stat-ing each one again.
+
+    """
+    latest = None
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with entries:
+            for entry in entries:
+                if "." in entry.name:
+                    mtime = entry.stat().st_mtime
+                    if latest is None or mtime > latest:
+                        latest = mtime
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    if latest is None:
         return None
+    return datetime.datetime.utcfromtimestamp(latest)
 
 
 def run(*args, **kwargs):
     """Run external command."""
+    import subprocess
+
     return subprocess.check_output(args, stderr=subprocess.STDOUT, **kwargs)
 
 
 def read_toml(filename):
-    return toml.load(filename)
+    """Return data from TOML filename, or from an already opened binary file."""
+    if hasattr(filename, "read"):
+        data = filename.read()
+    else:
+        data = pathlib.Path(filename).read_bytes()
+    return _parse_toml(data.decode())
 
 
 def write_toml(filename, obj):
+    import toml
+
     with filename.open("w") as f:
         toml.dump(obj, f)
 
 
+def sha256_file(filename):
+    """Return the hex SHA-256 digest of the given file's contents."""
+    import hashlib
+
+    with open(filename, "rb") as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        digest = hashlib.sha256()
+        if os.fstat(f.fileno()).st_size > 0:  # Empty files cannot be mapped.
+            import mmap
+
+            # Hash the whole file in one call rather than in a Python read loop.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest.update(mm)
+        return digest.hexdigest()
+
+
+def download_uri(uri, filename, chunk_size=1024 * 1024):
+    """Download the resource at uri (file, http or https) to filename."""
+    import urllib.parse
+    import urllib.request
+
+    parsed = urllib.parse.urlparse(uri)
+    if parsed.scheme == "file":
+        shutil.copyfile(urllib.request.url2pathname(parsed.path), filename)
+    elif parsed.scheme in ("http", "https"):
+        import requests
+
+        with requests.get(uri, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(filename, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+    else:
+        urllib.request.urlretrieve(uri, filename)
+
+
 def create_targz(directory, filename):
+    import tarfile
+
     with tarfile.open(filename, "w:gz") as tar:
         tar.add(directory, arcname=directory.name)
 
 
-def create_targz_as_bytes(directory):
+def _add_parts(tar, directory, names, arcname):
+    tar.add(directory, arcname=arcname, recursive=False)
+    for name in sorted(str(name) for name in names):
+        if (directory / name).exists():
+            tar.add(directory / name, arcname=f"{arcname}/{name}")
+
+
+def create_targz_from_parts(directory, names, arcname, filename):
+    """Create tar.gz of the named entries of directory, as if inside directory arcname.
+
+    Equivalent to copying them into a new directory and using `create_targz`, but
+    without the copy. Like `shutil.copytree`, symlinks are followed.
+
+    """
+    import tarfile
+
+    with tarfile.open(filename, "w:gz", dereference=True) as tar:
+        _add_parts(tar, directory, names, arcname)
+
+
+def create_targz_as_bytes(directory, compresslevel=1):
+    """Return a tar.gz of directory as bytes.
+
+    Defaults to fast compression, because the result is uploaded once and discarded.
+
+    """
+    import tarfile
+
     data = io.BytesIO()
-    with tarfile.open(mode="w:gz", fileobj=data) as tar:
+    with tarfile.open(mode="w:gz", fileobj=data, compresslevel=compresslevel) as tar:
         tar.add(directory, arcname=directory.name)
     return data.getvalue()
 
 
+def create_targz_from_parts_as_bytes(directory, names, arcname, compresslevel=1):
+    """Return `create_targz_from_parts` output as bytes, like `create_targz_as_bytes`."""
+    import tarfile
+
+    data = io.BytesIO()
+    with tarfile.open(
+        mode="w:gz", fileobj=data, compresslevel=compresslevel, dereference=True
+    ) as tar:
+        _add_parts(tar, directory, names, arcname)
+    return data.getvalue()
+
+
 @contextlib.contextmanager
 def open_targz_member(filename, member_name):
     """Contextmanager of io.BufferedReader with archive member `member_name`'s data.
@@ -176,10 +379,18 @@ def open_targz_member(filename, member_name):
     Raise KeyError if no matching member found.
 
     """
+    import tarfile
+
     with tarfile.open(filename, mode="r:gz") as tar:
         member_path = pathlib.Path(member_name)
-        for entry_name in tar.getnames():
-            entry_path = pathlib.Path(entry_name)
+        # Iterate rather than use getnames() so that the archive is only decompressed
+        # as far as the wanted member, and pass the TarInfo to extractfile() to save it
+        # from searching the members again.
+        for entry in tar:
+            # Cheaply skip members with a different name before comparing paths.
+            if entry.name.rstrip("/").rpartition("/")[2] != member_path.name:
+                continue
+            entry_path = pathlib.Path(entry.name)
             # The following could be use when we target python>=3.9
             # if (
             #     entry_path.is_relative_to(member_path.parent)
@@ -187,39 +398,63 @@ def open_targz_member(filename, member_name):
             # ):
             try:
                 rel_path = entry_path.relative_to(member_path.parent)
-                if rel_path.name == member_path.name:
-                    yield tar.extractfile(entry_name)
-                    break
             except ValueError:
-                pass
+                continue
+            if rel_path.name == member_path.name:
+                yield tar.extractfile(entry)
+                break
         else:
             raise KeyError(member_name)
 
 
 def parse(obj, format):
-    if format == "json":
-        return json.loads(obj)
-    elif format == "toml":
-        return toml.loads(obj)
-    raise ValueError(f"Unsupported format: {format}")
+    parser = PARSERS.get(format)
+    if parser is None:
+        raise ValueError(f"Unsupported format: {format}")
+    return parser(obj)
+
+
+def visual_poll(
+    message,
+    poll,
+    NoTaskResultYet,
+    wait=0.2,
+    max_wait=10.0,
+    backoff=1.5,
+    flush_interval=2.0,
+):
+    """Call `poll` until it returns a result, backing off exponentially in between.
+
+    Short tasks are still noticed quickly, while long running ones (e.g. backups) are
+    not polled more than once every `max_wait` seconds. Progress dots are written out
+    at most every `flush_interval` seconds, but errors are shown straight away.
 
+    """
+    import requests.exceptions
 
-def visual_poll(message, poll, NoTaskResultYet, wait=0.2):
     log(message, nl=False)
     result = NoTaskResultYet
     count = 0
+    progress = ""
+    last_flush = time.monotonic()
     while result is NoTaskResultYet:
-        progress_char = "."
         try:
             result = poll()
+            progress += "."
         except requests.exceptions.RequestException:
-            progress_char = click.style("E", fg="red")
-        log(progress_char, nl=False)
-        time.sleep(wait)
+            progress += click.style("E", fg="red")
+            last_flush = -flush_interval  # Show the error now.
         count += 1
+        if result is NoTaskResultYet:
+            if time.monotonic() - last_flush >= flush_interval:
+                log(progress, nl=False)
+                progress = ""
+                last_flush = time.monotonic()
+            time.sleep(wait)
+            wait = min(max_wait, wait * backoff)
     if count < 3:
-        log("." * (3 - count), nl=False)
-    log("Done")
+        progress += "." * (3 - count)
+    log(f"{progress}Done")
     return result
 
 
@@ -234,6 +469,8 @@ def run_task(
     is_idempotent=False,
 ):
     """Return the raw json result or log (HTTP) error and abort."""
+    import encapsia_api
+
     poll, NoTaskResultYet = api.run_task(
         namespace,
         name,
@@ -284,6 +521,8 @@ def run_job(
     is_idempotent=False,
 ):
     """Run job, wait for it to complete, and log all joblogs; or log error from task."""
+    import encapsia_api
+
     poll, NoResultYet = api.run_job(
         namespace,
         function,
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-import collections
+import datetime
+import functools
 import re
 import typing as T
 from dataclasses import dataclass
@@ -8,9 +9,6 @@ from functools import total_ordering
 from pathlib import Path
 from warnings import warn
 
-import arrow
-import semver
-
 from encapsia_cli import lib, s3
 
 
@@ -34,19 +32,24 @@ class InvalidSpecError(Exception):
 
 
 def _format_datetime(dt):
-    return arrow.get(dt).strftime("%a %d %b %Y %H:%M:%S")
-    # In Python 3.7 and beyond we could do the following. But we want to support Python 3.6.
-    # return datetime.datetime.fromisoformat(dt).strftime("%a %d %b %Y %H:%M:%S")
+    # Only fall back to (slow to import) arrow for what fromisoformat cannot parse,
+    # which before Python 3.11 includes e.g. a "Z" suffix.
+    try:
+        parsed = datetime.datetime.fromisoformat(dt)
+    except (TypeError, ValueError):
+        import arrow
+
+        parsed = arrow.get(dt)
+    return parsed.strftime("%a %d %b %Y %H:%M:%S")
 
 
 def get_variant_from_tags(tags):
-    variant_tags = [t for t in tags if t.startswith("variant=")]
-    if len(variant_tags) == 0:
-        variant = None
-    elif len(variant_tags) == 1:
-        variant = variant_tags[0].split("=", 1)[1]
-    else:
-        raise TooManyVariantTagsError("Found more than one variant tags.")
+    variant = None
+    for tag in tags:
+        if tag.startswith("variant="):
+            if variant is not None:
+                raise TooManyVariantTagsError("Found more than one variant tags.")
+            variant = tag[len("variant=") :]
     return variant
 
 
@@ -80,21 +83,20 @@ class PluginInfo:
         self.semver = self._parse_version(self.version)
         self.variant = "" if variant is None else variant
         self.extras: T.Dict[str, str] = {}
+        # PluginInfos are compared and printed a lot (e.g. by sorted and max), so work
+        # these out once. Treat name, variant and version as read-only.
+        self._sort_key = (self.name, self.variant, self.semver)
+        variant_str = f"-variant-{self.variant}" if self.variant else ""
+        self._filename = f"plugin-{self.name}{variant_str}-{self.version}.tar.gz"
 
     def __eq__(self, other) -> bool:
         if isinstance(other, PluginInfo):
-            return (
-                self.name == other.name
-                and self.semver == other.semver
-                and self.variant == other.variant
-            )
+            return self._sort_key == other._sort_key
         return NotImplemented
 
     def __lt__(self, other) -> bool:
         if isinstance(other, PluginInfo):
-            self_values = (self.name, self.variant, self.semver)
-            other_values = (other.name, other.variant, other.semver)
-            return self_values < other_values
+            return self._sort_key < other._sort_key
         return NotImplemented
 
     def __str__(self):
@@ -108,7 +110,11 @@ class PluginInfo:
 
     @classmethod
     def get_name_variant_version_from_filename(cls, filename):
-        m = cls.PLUGIN_FILENAME_REGEX.match(str(filename))
+        filename_str = str(filename)
+        # Cheap rejection of names which cannot match, before using the regex.
+        m = None
+        if filename_str.endswith(".tar.gz") and "plugin-" in filename_str:
+            m = cls.PLUGIN_FILENAME_REGEX.match(filename_str)
         if m is None:
             raise ValueError(f"Unable to parse: {filename}")
         return m.group(1), m.group(2), m.group(3)  # (name, variant, version)
@@ -133,7 +139,7 @@ class PluginInfo:
     @classmethod
     def make_from_s3(cls, s3_bucket, s3_path):
         name, variant, version = cls.get_name_variant_version_from_filename(s3_path)
-        s3_path_without_filename = "/".join(s3_path.split("/")[:-1])
+        s3_path_without_filename = s3_path.rpartition("/")[0]
         return cls(s3_bucket, s3_path_without_filename, name, version, variant=variant)
 
     @classmethod
@@ -142,11 +148,28 @@ class PluginInfo:
             raise ValueError("Cannot make PluginInfo from PluginSpec with ANY variant")
         return cls(None, None, spec.name, spec.version_prefix, str(spec.variant))
 
-    @classmethod
-    def _parse_version(cls, version):
+    @staticmethod
+    def _parse_version(version):
+        import semver
+
+        try:
+            return PluginInfo._parse_valid_version(version)
+        except ValueError as e:
+            # Not cached, so that every plugin with a bad version is reported.
+            lib.log_error(str(e))
+            # At least return something comparable.
+            return semver.VersionInfo(major=0)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _parse_valid_version(version):
+        import semver
+
+        # Cached because the same versions recur across plugins, variants and stores.
+        # The VersionInfo results are immutable, so can be shared.
         # Consider a 4th digit to be a SemVer pre-release.
         # E.g. 1.2.3.4 is 1.2.3-4
-        m = cls.FOUR_DIGIT_VERSION_REGEX.match(version)
+        m = PluginInfo.FOUR_DIGIT_VERSION_REGEX.match(version)
         if m:
             major, minor, patch, prerelease = m.groups()
             return semver.VersionInfo(
@@ -154,19 +177,14 @@ class PluginInfo:
             )
         # Consider a "dev" build to be a SemVer pre-release.
         # E.g. 0.0.209dev12 is 0.0.209-12
-        m = cls.DEV_VERSION_REGEX.match(version)
+        m = PluginInfo.DEV_VERSION_REGEX.match(version)
         if m:
             major, minor, patch, prerelease = m.groups()
             return semver.VersionInfo(
                 major=major, minor=minor, patch=patch, prerelease=prerelease
             )
         # Otherwise hope that the semver package can deal with it.
-        try:
-            return semver.VersionInfo.parse(version)
-        except ValueError as e:
-            lib.log_error(str(e))
-            # At least return something comparable.
-            return semver.VersionInfo(major=0)
+        return semver.VersionInfo.parse(version)
 
     def formatted_version(self) -> str:
         version, semver = self.version, str(self.semver)
@@ -177,8 +195,7 @@ class PluginInfo:
         return f"{self.name}{variant_str}"
 
     def get_filename(self) -> str:
-        variant = f"-variant-{self.variant}" if self.variant else ""
-        return f"plugin-{self.name}{variant}-{self.version}.tar.gz"
+        return self._filename
 
     def get_s3_bucket(self) -> T.Optional[str]:
         return self.s3_bucket
@@ -223,17 +240,21 @@ class PluginInfos:
 
     @staticmethod
     def make_from_s3_buckets(plugins_s3_buckets):
+        pis = []
         try:
-            return PluginInfos(
-                [
-                    PluginInfo.make_from_s3(bucket, x["Key"])
-                    for bucket, x in s3.list_buckets(plugins_s3_buckets)
-                    if x["Key"].endswith(".tar.gz")
-                ]
-            )
+            for bucket, x in s3.list_buckets(plugins_s3_buckets):
+                key = x["Key"]
+                # Skip other objects in the bucket(s) without trying to parse them.
+                if not key.endswith(".tar.gz") or "plugin-" not in key:
+                    continue
+                try:
+                    pis.append(PluginInfo.make_from_s3(bucket, key))
+                except ValueError as e:
+                    lib.log_error(str(e))
         except s3.S3Error as e:
             lib.log_error(str(e), abort=True)
             return None  # Never reached, but keep linters happy
+        return PluginInfos(pis)
 
     @staticmethod
     def make_from_encapsia(host: str, bad_plugins_bin=None) -> PluginInfos:
@@ -308,14 +329,13 @@ class PluginInfos:
             return max(self.pis, default=None)
 
     def filter_to_latest(self) -> PluginInfos:
-        groupped_pis = collections.defaultdict(list)
+        latest: T.Dict[T.Tuple[str, str], PluginInfo] = {}
         for pi in self.pis:
-            groupped_pis[(pi.name, pi.variant)].append(pi)
-        return PluginInfos(
-            p
-            for pis in groupped_pis.values()
-            if (p := PluginInfos(pis).latest()) is not None
-        )
+            key = (pi.name, pi.variant)
+            current = latest.get(key)
+            if current is None or current._sort_key < pi._sort_key:
+                latest[key] = pi
+        return PluginInfos(latest.values())
 
     def filter_out_prereleases(self, include_prereleases=False) -> PluginInfos:
         if not include_prereleases:
@@ -339,11 +359,11 @@ class PluginSpec:
     version_prefix: str = ""
     exact_match: bool = False
 
-    PLUGIN_SPEC_NVV_REGEX: T.ClassVar[re.Pattern] = re.compile(
-        rf"^({ALLOWED_PLUGIN_NAME})(?:-variant-({ALLOWED_VARIANT}))?(?:-({ALLOWED_VERSION}))?$"
-    )
-    PLUGIN_SPEC_ANY_REGEX: T.ClassVar[re.Pattern] = re.compile(
-        rf"^({ALLOWED_PLUGIN_NAME})(?i:-ANY)(?:-({ALLOWED_VERSION}))?$"
+    # Either <name>[-variant-<variant>][-<version>] or <name>-ANY[-<version>].
+    PLUGIN_SPEC_REGEX: T.ClassVar[re.Pattern] = re.compile(
+        rf"^(?P<name>{ALLOWED_PLUGIN_NAME})"
+        rf"(?:(?P<any>(?i:-ANY))|(?:-variant-(?P<variant>{ALLOWED_VARIANT}))?)"
+        rf"(?:-(?P<version>{ALLOWED_VERSION}))?$"
     )
     ANY_VARIANT: T.ClassVar[T_Variant] = T_AnyVariant(object())
 
@@ -381,12 +401,10 @@ class PluginSpec:
         * <plugin_name>-<version_prefix>
         * <plugin_name>-variant-<variant_name>-<version_prefix>
         """
-        m = cls.PLUGIN_SPEC_NVV_REGEX.match(spec_string)
-        if m:
-            return m.group(1), m.group(2), m.group(3)  # name, variant, version_prefix
-        m = cls.PLUGIN_SPEC_ANY_REGEX.match(spec_string)
+        m = cls.PLUGIN_SPEC_REGEX.match(spec_string)
         if m:
-            return m.group(1), cls.ANY_VARIANT, m.group(2)  # name, ANY, version
+            variant = cls.ANY_VARIANT if m.group("any") else m.group("variant")
+            return m.group("name"), variant, m.group("version")
         raise InvalidSpecError(f"Spec string {spec_string} is invalid.")
 
     @classmethod
@@ -402,12 +420,8 @@ class PluginSpec:
         if isinstance(spec_or_string, str):
             instance = cls.make_from_string(spec_or_string)
         elif isinstance(spec_or_string, PluginSpec):
-            instance = cls(
-                spec_or_string.name,
-                spec_or_string.variant,
-                spec_or_string.version_prefix,
-                exact_match=spec_or_string.exact_match,
-            )
+            # Specs are never modified after creation, so no need to copy.
+            instance = spec_or_string
         else:
             raise TypeError(f"Unknown spec type {type(spec_or_string)}")
         return instance
@@ -1,13 +1,12 @@
 import datetime
-import shutil
+import os
 import tempfile
-import urllib.request
+import typing as T
+import urllib.parse
 from contextlib import contextmanager
-from io import TextIOWrapper
 from pathlib import Path
 
 import click
-import toml
 from tabulate import tabulate
 
 from encapsia_cli import lib, s3
@@ -74,22 +73,38 @@ def _add_to_local_store_from_uri(
     if not overwrite and store_filename.exists():
         lib.log(f"Found: {store_filename} (Skipping)")
     else:
-        filename, headers = urllib.request.urlretrieve(uri, tempfile.mkstemp()[1])
-        shutil.move(filename, store_filename)
+        # Download alongside the store so the final rename is atomic.
+        fd, filename = tempfile.mkstemp(dir=plugins_local_dir)
+        os.close(fd)
+        try:
+            lib.download_uri(uri, filename)
+            os.replace(filename, store_filename)
+        except BaseException:
+            os.unlink(filename)
+            raise
         lib.log(f"Added to local store: {store_filename}")
 
 
 def _add_to_local_store_from_s3(
-    pi: PluginInfo, plugins_local_dir: Path, overwrite: bool = False
+    pis: T.Iterable[PluginInfo], plugins_local_dir: Path, overwrite: bool = False
 ):
-    target = plugins_local_dir / pi.get_filename()
-    if not overwrite and target.exists():
-        lib.log(f"Found: {target} (Skipping)")
-    else:
-        try:
-            s3.download_file(pi.get_s3_bucket(), pi.get_s3_name(), target.as_posix())
-        except s3.S3Error as e:
-            lib.log_error(str(e))
+    to_download = []
+    for pi in pis:
+        target = plugins_local_dir / pi.get_filename()
+        if not overwrite and target.exists():
+            lib.log(f"Found: {target} (Skipping)")
+        else:
+            to_download.append((pi, target))
+    # Download concurrently, as plugins are often small enough for latency to dominate.
+    errors = s3.download_files(
+        [
+            (pi.get_s3_bucket(), pi.get_s3_name(), target.as_posix())
+            for pi, target in to_download
+        ]
+    )
+    for (pi, target), error in zip(to_download, errors):
+        if error is not None:
+            lib.log_error(str(error))
         else:
             lib.log(
                 f"Downloaded {pi.get_s3_bucket()}/{pi.get_s3_name()} and saved to {target}"
@@ -157,32 +172,86 @@ def _create_install_plan(
     return sorted(plan), to_download_from_s3
 
 
-def _install_plugin(api, filename: Path, print_output: bool = False):
-    """Use the API to install plugin directly from a file."""
-    if not filename.is_file():
-        lib.log_error(f"Cannot find plugin: {filename}", abort=True)
-    blob_id = api.upload_file_as_blob(
-        filename.as_posix(),
-    )
-    lib.log(f"Uploaded {filename} to blob: {blob_id}")
-    return lib.run_plugins_task(
-        api,
-        "install_plugin",
-        dict(blob_id=blob_id),
-        "Installing",
-        print_output=print_output,
-        is_idempotent=True,  # re-installing a plugin should be safe
-    )
+def _upload_plugin(
+    api, filename: Path, blobs: "UploadedBlobsCache", reuse_uploads: bool = True
+):
+    """Return (digest, blob_id, reused) after uploading filename unless already there.
+
+    Only reads from the blobs cache, so is safe to call from worker threads.
+
+    """
+    digest = lib.sha256_file(filename)
+    blob_id = blobs.get(api, digest) if reuse_uploads else None
+    if blob_id is not None and blobs.exists_on_server(api, blob_id):
+        return digest, blob_id, True
+    return digest, api.upload_file_as_blob(filename.as_posix()), False
+
+
+def _install_plugins(
+    api,
+    filenames: T.List[Path],
+    blobs: "UploadedBlobsCache",
+    reuse_uploads: bool = True,
+    print_output: bool = False,
+):
+    """Use the API to install plugins directly from files, in the given order.
+
+    The files are uploaded concurrently ahead of their installation, which is still
+    one at a time. Unless reuse_uploads is False, files already uploaded to this server
+    (as recorded in blobs) are not uploaded again.
+
+    Return True if all the installations succeeded.
+
+    """
+    import concurrent.futures
+
+    for filename in filenames:
+        if not filename.is_file():
+            lib.log_error(f"Cannot find plugin: {filename}", abort=True)
+    if not filenames:
+        return True
+    success = True
+    max_workers = min(8, len(filenames))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    uploads = [
+        executor.submit(_upload_plugin, api, filename, blobs, reuse_uploads)
+        for filename in filenames
+    ]
+    try:
+        for filename, upload in zip(filenames, uploads):
+            digest, blob_id, reused = upload.result()
+            if reused:
+                lib.log(f"Already uploaded {filename} to blob: {blob_id}")
+            else:
+                lib.log(f"Uploaded {filename} to blob: {blob_id}")
+                blobs.set(api, digest, blob_id)
+                blobs.save()
+            success &= lib.run_plugins_task(
+                api,
+                "install_plugin",
+                dict(blob_id=blob_id),
+                "Installing",
+                print_output=print_output,
+                is_idempotent=True,  # re-installing a plugin should be safe
+            )
+    except BaseException:
+        # Don't start uploads which will never be installed (e.g. on Ctrl-C), nor wait
+        # here for those already running.
+        for upload in uploads:
+            upload.cancel()
+        executor.shutdown(wait=False)
+        raise
+    executor.shutdown()
+    return success
 
 
 def _download_plugins_from_s3(
     plugins_to_download, plugins_local_dir, plugins_force, added_from_file_or_uri=False
 ):
     if plugins_to_download:
-        for plugin in plugins_to_download:
-            _add_to_local_store_from_s3(
-                plugin, plugins_local_dir, overwrite=plugins_force
-            )
+        _add_to_local_store_from_s3(
+            plugins_to_download, plugins_local_dir, overwrite=plugins_force
+        )
     else:
         if not added_from_file_or_uri:
             lib.log("Nothing to do!")
@@ -450,11 +519,12 @@ def install(
         s3_plugins = PluginInfos.make_from_s3_buckets(
             plugins_s3_buckets
         ).filter_out_prereleases(include_prereleases)
-        for s3_plugin in s3_plugins:
-            _add_to_local_store_from_s3(
-                s3_plugin, plugins_local_dir, overwrite=(plugins_force or overwrite)
-            )
-            to_install_candidates.append(PluginSpec.make_from_plugininfo(s3_plugin))
+        _add_to_local_store_from_s3(
+            s3_plugins, plugins_local_dir, overwrite=(plugins_force or overwrite)
+        )
+        to_install_candidates.extend(
+            PluginSpec.make_from_plugininfo(p) for p in s3_plugins
+        )
 
     # Work out and list installation plan.
     # to_install_candidates = sorted(PluginInfos(to_install_candidates))
@@ -493,15 +563,19 @@ def install(
     # Install them.
     lib.log("")
     if to_install:
-        for pi in to_download_from_s3:
-            _add_to_local_store_from_s3(
-                pi, plugins_local_dir, overwrite=(plugins_force or overwrite)
-            )
+        _add_to_local_store_from_s3(
+            to_download_from_s3,
+            plugins_local_dir,
+            overwrite=(plugins_force or overwrite),
+        )
         api = lib.get_api(**obj)
-        for pi in to_install:
-            success = _install_plugin(
-                api, plugins_local_dir / pi.get_filename(), print_output=show_logs
-            )
+        success = _install_plugins(
+            api,
+            [plugins_local_dir / pi.get_filename() for pi in to_install],
+            UploadedBlobsCache(plugins_local_dir),
+            reuse_uploads=not plugins_force,
+            print_output=show_logs,
+        )
         if not success:
             lib.log_error("Some plugins failed to install.", abort=True)
     else:
@@ -568,6 +642,48 @@ def dev_list(obj):
     lib.run_plugins_task(api, "list_namespaces", dict(), "Fetching list of namespaces")
 
 
+class UploadedBlobsCache:
+    """Record of the blob each plugin file was uploaded to, per server and digest."""
+
+    def __init__(self, directory):
+        encapsia_directory = directory / ".encapsia"
+        encapsia_directory.mkdir(parents=True, exist_ok=True)
+        self.filename = encapsia_directory / "uploaded_blobs.toml"
+        self._saved_data = None  # What the file is known to contain.
+        if not self.filename.exists():
+            self.data = {}
+        else:
+            self.data = lib.read_toml(self.filename)
+            self._saved_data = {url: dict(d) for url, d in self.data.items()}
+
+    def save(self):
+        if self.data == self._saved_data:
+            return
+        lib.write_toml(self.filename, self.data)
+        self._saved_data = {url: dict(d) for url, d in self.data.items()}
+
+    def get(self, api, digest):
+        return self.data.get(api.url, {}).get(digest)
+
+    def set(self, api, digest, blob_id):
+        self.data.setdefault(api.url, {})[digest] = blob_id
+
+    @staticmethod
+    def exists_on_server(api, blob_id):
+        import encapsia_api
+
+        try:
+            response = api.call_api(
+                "head",
+                ("blobs", blob_id),
+                expected_codes=(200, 302, 404),
+                is_idempotent=True,
+            )
+        except encapsia_api.EncapsiaApiError:
+            return False
+        return response.status_code == 200
+
+
 class LastUploadedVsModifiedTracker:
 
     DIRECTORIES = ["tasks", "views", "wheels", "webfiles", "schedules"]
@@ -577,6 +693,7 @@ class LastUploadedVsModifiedTracker:
         encapsia_directory = directory / ".encapsia"
         encapsia_directory.mkdir(parents=True, exist_ok=True)
         self.filename = encapsia_directory / "last_uploaded_plugin_parts.toml"
+        self._saved_data = None  # What the file is known to contain.
         if reset:
             self.make_empty()
         else:
@@ -590,24 +707,24 @@ class LastUploadedVsModifiedTracker:
         if not self.filename.exists():
             self.make_empty()
         else:
-            with self.filename.open() as f:
-                self.data = toml.load(f)
+            self.data = lib.read_toml(self.filename)
+            self._saved_data = dict(self.data)
 
     def save(self):
-        with self.filename.open("w") as f:
-            toml.dump(self.data, f)
+        if self.data == self._saved_data:
+            return
+        lib.write_toml(self.filename, self.data)
+        self._saved_data = dict(self.data)
 
     def get_modified_directories(self):
         for name in self.DIRECTORIES:
             last_modified = lib.most_recently_modified(self.directory / name)
-            if last_modified is not None:
-                if name in self.data:
-                    if last_modified > self.data[name]:
-                        yield Path(name)
-                        self.data[name] = datetime.datetime.utcnow()
-                else:
-                    yield Path(name)
-                    self.data[name] = datetime.datetime.utcnow()
+            if last_modified is None:
+                continue
+            last_uploaded = self.data.get(name)
+            if last_uploaded is None or last_modified > last_uploaded:
+                yield Path(name)
+                self.data[name] = datetime.datetime.utcnow()
 
 
 @main.command("dev-update")
@@ -635,24 +752,23 @@ def dev_update(obj, upload_all, directory):
         directory, reset=obj["plugins_force"] or upload_all
     ) as modified_plugin_directories:
         if modified_plugin_directories:
-            with lib.temp_directory() as temp_directory:
-                shutil.copy(plugin_toml_path, temp_directory)
-                for modified_directory in modified_plugin_directories:
-                    lib.log(f"Including: {modified_directory}")
-                    shutil.copytree(
-                        directory / modified_directory,
-                        temp_directory / modified_directory,
-                    )
-                api = lib.get_api(**obj)
-                result = lib.run_plugins_task(
-                    api,
-                    "dev_update_plugin",
-                    {},
-                    "Uploading to server",
-                    data=lib.create_targz_as_bytes(temp_directory),
-                )
-                if not result:
-                    raise _PluginsTaskError
+            for modified_directory in modified_plugin_directories:
+                lib.log(f"Including: {modified_directory}")
+            data = lib.create_targz_from_parts_as_bytes(
+                directory,
+                ["plugin.toml", *modified_plugin_directories],
+                "plugin",
+            )
+            api = lib.get_api(**obj)
+            result = lib.run_plugins_task(
+                api,
+                "dev_update_plugin",
+                {},
+                "Uploading to server",
+                data=data,
+            )
+            if not result:
+                raise _PluginsTaskError
         else:
             lib.log("Nothing to do.")
 
@@ -741,25 +857,13 @@ def dev_build(obj, overwrite, sources):
         if not (plugins_force or overwrite) and output_filename.exists():
             lib.log(f"Found: {output_filename} (Skipping)")
         else:
-            with lib.temp_directory() as temp_directory:
-                base_dir = temp_directory / f"plugin-{name}-{version}"
-                base_dir.mkdir()
-                for t in (
-                    "webfiles",
-                    "views",
-                    "tasks",
-                    "wheels",
-                    "schedules",
-                    "plugin.toml",
-                ):
-                    source_t = source_directory / t
-                    if source_t.exists():
-                        if source_t.is_file():
-                            shutil.copy(source_t, base_dir / t)
-                        else:
-                            shutil.copytree(source_t, base_dir / t)
-                lib.create_targz(base_dir, output_filename)
-                lib.log(f"Added to local store: {output_filename}")
+            lib.create_targz_from_parts(
+                source_directory,
+                ("webfiles", "views", "tasks", "wheels", "schedules", "plugin.toml"),
+                f"plugin-{name}-{version}",
+                output_filename,
+            )
+            lib.log(f"Added to local store: {output_filename}")
 
 
 @main.command()
@@ -970,8 +1074,8 @@ def ls(obj, all_versions, long_format, plugins):
         filename = plugins_local_dir / pi.get_filename()
         try:
             with lib.open_targz_member(filename, "plugin.toml") as f:
-                return lib.read_toml(TextIOWrapper(f))["description"]
-        except SyntaxError:
+                return lib.read_toml(f)["description"]
+        except (SyntaxError, ValueError):
             lib.log_error(f"Malformed? Unable to read: {filename}")
             return "N/A"
 
@@ -1,16 +1,19 @@
 import typing as T
 from itertools import repeat
 
-import boto3
-import botocore
-
 
 class S3Error(Exception):
     pass
 
 
-def list_bucket(bucket: str, prefix: str = "") -> T.Iterable[dict]:
-    s3 = boto3.client("s3")
+# boto3 takes ~0.1s to import, so only do so when S3 is actually used.
+
+
+def list_bucket(bucket: str, prefix: str = "", client=None) -> T.Iterable[dict]:
+    import boto3
+    import botocore.exceptions
+
+    s3 = boto3.client("s3") if client is None else client
     paginator = s3.get_paginator("list_objects_v2")
     page_iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
     try:
@@ -22,17 +25,78 @@ def list_bucket(bucket: str, prefix: str = "") -> T.Iterable[dict]:
 
 
 def list_buckets(bucket_paths: T.Iterable[str]) -> T.Iterable[T.Tuple[str, dict]]:
+    """Yield (bucket, item) for all the bucket paths, in the order given.
+
+    The buckets are listed concurrently, because each listing is a series of
+    round-trips to S3.
+
+    """
+    import concurrent.futures
+
+    import boto3
+
+    buckets_and_prefixes = []
     for bucket_path in bucket_paths:
         if "/" in bucket_path:
             bucket, prefix = bucket_path.split("/", 1)
         else:
             bucket, prefix = bucket_path, ""
-        yield from zip(repeat(bucket), list_bucket(bucket, prefix))
+        buckets_and_prefixes.append((bucket, prefix))
+    if not buckets_and_prefixes:
+        return
+    # Clients are thread safe, but creating them from the default session is not.
+    s3 = boto3.client("s3")
 
+    def _list_bucket(bucket, prefix):
+        return list(list_bucket(bucket, prefix, client=s3))
 
-def download_file(bucket, name, target):
-    s3 = boto3.client("s3")
+    max_workers = min(16, len(buckets_and_prefixes))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_list_bucket, bucket, prefix)
+            for bucket, prefix in buckets_and_prefixes
+        ]
+        for (bucket, _), future in zip(buckets_and_prefixes, futures):
+            yield from zip(repeat(bucket), future.result())
+
+
+def download_file(bucket, name, target, client=None):
+    import boto3
+    import botocore.exceptions
+
+    s3 = boto3.client("s3") if client is None else client
     try:
         s3.download_file(bucket, name, target)
     except botocore.exceptions.ClientError as e:
         raise S3Error(f"Unable to download: {bucket}/{name}") from e
+
+
+def download_files(
+    downloads: T.Sequence[T.Tuple[str, str, str]]
+) -> T.Iterable[T.Optional[S3Error]]:
+    """Download each (bucket, name, target) concurrently.
+
+    Yield None or the S3Error for each download, in the order given.
+
+    """
+    import concurrent.futures
+
+    import boto3
+
+    if not downloads:
+        return
+    # Clients are thread safe, but creating them from the default session is not.
+    s3 = boto3.client("s3")
+    max_workers = min(8, len(downloads))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(download_file, bucket, name, target, client=s3)
+            for bucket, name, target in downloads
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except S3Error as e:
+                yield e
+            else:
+                yield None
@@ -8,6 +8,7 @@ import click_shell
 @click.pass_context
 def main(ctx):
     """Start an interactive shell for running the encapsia commands."""
+    ctx.obj["interactive_shell"] = True
     host = ctx.obj.get("host")
     if host:
         os.environ["ENCAPSIA_HOST"] = host
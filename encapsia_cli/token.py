@@ -1,5 +1,4 @@
 import click
-from encapsia_api import CredentialsStore, EncapsiaApi, EncapsiaApiError
 
 from encapsia_cli import lib
 
@@ -17,6 +16,8 @@ def main():
 @click.pass_obj
 def expire(obj):
     """Expire token from server, and update encapsia credentials if used."""
+    from encapsia_api import EncapsiaApiError
+
     api = lib.get_api(**obj)
     try:
         api.delete("logout")
@@ -24,9 +25,10 @@ def expire(obj):
     except EncapsiaApiError as e:
         lib.log_error("Failed to expire given token!")
         lib.log_error(str(e), abort=True)
+    lib.forget_api(obj)
     host = obj.get("host")
     if host:
-        CredentialsStore().remove(host)
+        lib.get_credentials_store().remove(host)
         lib.log("Removed entry from encapsia credentials file.")
 
 
@@ -81,9 +83,10 @@ def extend(obj, lifespan, capabilities, store, display, shell):
     new_token = api.login_again(lifespan=lifespan, capabilities=capabilities)
     host = obj.get("host")
     if host and store:
-        store = CredentialsStore()
+        store = lib.get_credentials_store()
         url, _ = store.get(host)
         store.set(host, url, new_token)
+        lib.forget_api(obj)
         lib.log("Encapsia credentials file updated.")
     else:
         lib.print_token(new_token, display, url=api.url, shell=shell)
@@ -118,6 +121,8 @@ def extend(obj, lifespan, capabilities, store, display, shell):
 @click.pass_obj
 def transfer(obj, lifespan, display, shell, user):
     """Get a token for `user` (subject to proper capabilities)"""
+    from encapsia_api import EncapsiaApi
+
     api = lib.get_api(**obj)
     user_token = api.login_transfer(user)
     user_api = EncapsiaApi(api.url, user_token)
@@ -136,5 +141,5 @@ def transfer(obj, lifespan, display, shell, user):
 def env(obj, shell):
     """Generate shell commands to populate encapsia host environment variables."""
     host = obj.get("host")
-    url, token = CredentialsStore().get(host)
+    url, token = lib.get_credentials_store().get(host)
     lib.print_token(token, "shell", url, shell)
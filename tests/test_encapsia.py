@@ -0,0 +1,30 @@
+import importlib
+
+import pytest
+from click.testing import CliRunner
+
+from encapsia_cli.encapsia import COMMANDS, main
+
+
+@pytest.mark.parametrize("name", sorted(COMMANDS))
+def test_lazy_command_short_help_matches_module(name):
+    module_name, short_help = COMMANDS[name]
+    command = importlib.import_module(module_name).main
+    assert command.name == name
+    assert command.get_short_help_str(limit=1000) == short_help
+
+
+def test_help_lists_all_commands():
+    runner = CliRunner()
+    result = runner.invoke(main, ["--help"])
+    assert result.exit_code == 0
+    for name in COMMANDS:
+        assert f"{name}  " in result.output
+
+
+def test_help_lists_all_subcommands():
+    runner = CliRunner()
+    result = runner.invoke(main, ["help"])
+    assert result.exit_code == 0
+    assert "\nSubcommands:\n" in result.output
+    assert "  plugins ls " in result.output
@@ -0,0 +1,148 @@
+import datetime
+import functools
+import hashlib
+import http.server
+import json
+import os
+import threading
+
+import click
+import pytest
+import requests
+
+from encapsia_cli import lib
+
+
+@pytest.mark.parametrize(
+    "email",
+    ["user@example.com", "first.last+tag@sub.example.co.uk", "a_b%c@x-y.org"],
+)
+def test_validate_email_accepts_valid_addresses(email):
+    assert lib.validate_email(None, None, email) == email
+
+
+@pytest.mark.parametrize(
+    "email",
+    [
+        "",
+        "user",
+        "user@example",
+        "user.example.com",
+        "@example.com",
+        "user@example.c",
+        "user@example.com\n",
+        "usér@example.com",
+    ],
+)
+def test_validate_email_rejects_invalid_addresses(email):
+    with pytest.raises(click.BadParameter):
+        lib.validate_email(None, None, email)
+
+
+def test_most_recently_modified_of_missing_or_empty_directory(tmp_path):
+    assert lib.most_recently_modified(tmp_path / "missing") is None
+    assert lib.most_recently_modified(tmp_path) is None
+
+
+def test_most_recently_modified_matches_glob(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    for i, name in enumerate(["x.txt", "a/y.sql", "a/b/z.py", "a/b/no_dot"]):
+        path = tmp_path / name
+        path.write_text("")
+        os.utime(path, (1000 + i, 1000 + i))
+    (tmp_path / "a" / "b" / "up").symlink_to("..")  # A loop, not to be followed.
+    expected = datetime.datetime.utcfromtimestamp(
+        max(p.stat().st_mtime for p in tmp_path.glob("**/*.*"))
+    )
+    assert lib.most_recently_modified(tmp_path) == expected
+    assert expected == datetime.datetime.utcfromtimestamp(1002)
+
+
+def test_read_toml_from_filename_or_binary_file(tmp_path):
+    filename = tmp_path / "x.toml"
+    lib.write_toml(filename, {"name": "x", "nested": {"number": 1}})
+    expected = {"name": "x", "nested": {"number": 1}}
+    assert lib.read_toml(filename) == expected
+    assert lib.read_toml(str(filename)) == expected
+    with filename.open("rb") as f:
+        assert lib.read_toml(f) == expected
+
+
+def test_open_targz_member(tmp_path):
+    plugin_dir = tmp_path / "plugin"
+    (plugin_dir / "views").mkdir(parents=True)
+    (plugin_dir / "plugin.toml").write_text('name = "plugin"\n')
+    (plugin_dir / "views" / "a.sql").write_text("select 1;\n")
+    filename = tmp_path / "plugin.tar.gz"
+    lib.create_targz(plugin_dir, filename)
+    with lib.open_targz_member(filename, "plugin.toml") as f:
+        assert lib.read_toml(f) == {"name": "plugin"}
+    with lib.open_targz_member(filename, "plugin/views/a.sql") as f:
+        assert f.read() == b"select 1;\n"
+    with pytest.raises(KeyError):
+        with lib.open_targz_member(filename, "missing.toml"):
+            pass
+    with pytest.raises(ValueError):
+        with lib.open_targz_member(filename, "plugin.toml"):
+            raise ValueError()
+
+
+@pytest.mark.parametrize(
+    "shell, token, expected",
+    [
+        ("bash", "a'b c", "export ENCAPSIA_TOKEN='a'\"'\"'b c'"),
+        ("bash", "a\\b\\", "export ENCAPSIA_TOKEN='a\\b\\'"),
+        ("fish", "a'b c", "set -xU ENCAPSIA_TOKEN 'a\\'b c'"),
+        ("fish", "a\\b\\", "set -xU ENCAPSIA_TOKEN 'a\\\\b\\\\'"),
+    ],
+)
+def test_print_token_quotes_token_for_shell(shell, token, expected, capsys):
+    with click.Context(click.Command("test"), obj={"silent": False}):
+        lib.print_token(token, "shell", url="https://x.example.com", shell=shell)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1] == expected
+
+
+@pytest.mark.parametrize("has_file_digest", [True, False])
+@pytest.mark.parametrize("data", [b"", b"abc" * 1000000])
+def test_sha256_file(tmp_path, monkeypatch, has_file_digest, data):
+    if not has_file_digest:
+        monkeypatch.delattr(hashlib, "file_digest", raising=False)
+    filename = tmp_path / "x.bin"
+    filename.write_bytes(data)
+    assert lib.sha256_file(filename) == hashlib.sha256(data).hexdigest()
+
+
+def test_download_uri_from_file(tmp_path):
+    source = tmp_path / "source.tar.gz"
+    source.write_bytes(b"x" * 3000000)
+    target = tmp_path / "target.tar.gz"
+    lib.download_uri(source.as_uri(), target)
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_download_uri_from_http(tmp_path):
+    source = tmp_path / "source.tar.gz"
+    source.write_bytes(b"x" * 3000000)
+    handler = functools.partial(
+        http.server.SimpleHTTPRequestHandler, directory=str(tmp_path)
+    )
+    handler.log_message = lambda *args: None
+    with http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            target = tmp_path / "target.tar.gz"
+            lib.download_uri(f"{url}/source.tar.gz", target)
+            assert target.read_bytes() == source.read_bytes()
+            with pytest.raises(requests.exceptions.HTTPError):
+                lib.download_uri(f"{url}/missing.tar.gz", tmp_path / "missing")
+        finally:
+            server.shutdown()
+
+
+@pytest.mark.parametrize("text", ["12345678901234567890123", "NaN", "1e400", "[1.5]"])
+def test_parse_json_matches_stdlib(text):
+    parsed, expected = lib.parse(text, "json"), json.loads(text)
+    assert repr(parsed) == repr(expected)
@@ -6,7 +6,15 @@ import pytest
 import semver
 import toml
 
-from encapsia_cli.plugininfo import PluginInfo, PluginInfos, PluginSpec, PluginSpecs
+from encapsia_cli.plugininfo import (
+    PluginInfo,
+    PluginInfos,
+    PluginSpec,
+    PluginSpecs,
+    TooManyVariantTagsError,
+    _format_datetime,
+    get_variant_from_tags,
+)
 
 
 # Note: these need to be both extended (in coverage) and reduced (in test data duplication).
@@ -99,6 +107,37 @@ def presorted_plugininfo_list(name_variant_version_list):
     ]
 
 
+@pytest.mark.parametrize(
+    "tags, expected",
+    [
+        ([], None),
+        (["example"], None),
+        (["example", "variant=foo"], "foo"),
+        (["variant=foo=bar"], "foo=bar"),
+    ],
+)
+def test_get_variant_from_tags(tags, expected):
+    assert get_variant_from_tags(tags) == expected
+
+
+def test_get_variant_from_tags_with_too_many_variants():
+    with pytest.raises(TooManyVariantTagsError):
+        get_variant_from_tags(["variant=foo", "example", "variant=bar"])
+
+
+@pytest.mark.parametrize(
+    "dt",
+    [
+        "2021-03-04T05:06:07",
+        "2021-03-04T05:06:07.123456+00:00",
+        "2021-03-04T05:06:07Z",
+        "2021-03-04 05:06:07.12+02:00",
+    ],
+)
+def test_format_datetime(dt):
+    assert _format_datetime(dt) == "Thu 04 Mar 2021 05:06:07"
+
+
 class TestPluginInfo:
     @pytest.mark.parametrize(
         "filename,expected",
@@ -183,6 +222,11 @@ class TestPluginInfo:
     def test_parse_version(self, version, expected):
         assert PluginInfo._parse_version(version) == expected
 
+    def test_parse_version_reports_every_bad_version(self, capsys):
+        for _ in range(2):
+            PluginInfo.make_from_name_variant_version("foo", "", "123aaa")
+        assert capsys.readouterr().err.count("123aaa") == 2
+
     @pytest.mark.parametrize(
         "nvv1,nvv2",
         # poor person's QuickCheck / hypotesis
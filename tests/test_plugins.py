@@ -1,7 +1,16 @@
+import concurrent.futures
+import tarfile
+import threading
+from pathlib import Path
+
+import click
 import pytest
 from click.testing import CliRunner
 
+from encapsia_cli import lib, plugins, s3
 from encapsia_cli.encapsia import main
+from encapsia_cli.plugininfo import PluginInfos
+from encapsia_cli.plugins import LastUploadedVsModifiedTracker, UploadedBlobsCache
 
 
 MANIFEST = """\
@@ -71,6 +80,31 @@ def test_dev_build_without_variant(example_plugin, local_store):
     assert (local_store / "plugin-example-0.0.1.tar.gz").exists()
 
 
+def test_dev_build_archives_only_plugin_parts(example_plugin, local_store):
+    (example_plugin / "views").mkdir()
+    (example_plugin / "views" / "a.sql").write_text("select 1;\n")
+    (example_plugin / "README.md").write_text("Not part of the plugin.\n")
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        [
+            "plugins",
+            "--local-dir",
+            local_store.as_posix(),
+            "dev-build",
+            example_plugin.as_posix(),
+        ],
+    )
+    assert result.exit_code == 0
+    with tarfile.open(local_store / "plugin-example-0.0.1.tar.gz") as tar:
+        assert tar.getnames() == [
+            "plugin-example-0.0.1",
+            "plugin-example-0.0.1/plugin.toml",
+            "plugin-example-0.0.1/views",
+            "plugin-example-0.0.1/views/a.sql",
+        ]
+
+
 def test_dev_build_with_variant(example_plugin_variant, local_store):
     runner = CliRunner()
     result = runner.invoke(
@@ -105,3 +139,120 @@ def test_dev_build_with_extra_variant_fails(example_plugin_extra_variant, local_
     )
     assert result.exit_code != 0
     assert list(local_store.iterdir()) == []
+
+
+def test_tracker_only_rewrites_file_when_changed(example_plugin):
+    (example_plugin / "views").mkdir()
+    (example_plugin / "views" / "a.sql").write_text("select 1;\n")
+    tracker = LastUploadedVsModifiedTracker(example_plugin)
+    assert list(tracker.get_modified_directories()) == [Path("views")]
+    tracker.save()
+    saved = tracker.filename.read_text()
+    tracker = LastUploadedVsModifiedTracker(example_plugin)
+    assert list(tracker.get_modified_directories()) == []
+    tracker.filename.write_text(saved + "# Untouched by save.\n")
+    tracker.save()
+    assert tracker.filename.read_text().endswith("# Untouched by save.\n")
+
+
+def test_uploaded_blobs_cache_is_per_server(tmp_path):
+    class Api:
+        def __init__(self, url):
+            self.url = url
+
+    first, second = Api("https://a.example.com"), Api("https://b.example.com")
+    blobs = UploadedBlobsCache(tmp_path)
+    blobs.set(first, "abc123", "blob1")
+    blobs.save()
+    blobs = UploadedBlobsCache(tmp_path)
+    assert blobs.get(first, "abc123") == "blob1"
+    assert blobs.get(second, "abc123") is None
+
+
+def test_install_plugins_cancels_pending_uploads_on_error(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    class Api:
+        url = "https://a.example.com"
+
+        def __init__(self):
+            self.started = []
+            self.lock = threading.Lock()
+
+        def upload_file_as_blob(self, filename):
+            with self.lock:
+                self.started.append(filename)
+            if filename.endswith("plugin-x0-1.0.0.tar.gz"):
+                raise RuntimeError("Upload failed")
+            release.wait()  # Still uploading when the first upload fails.
+            return "blob"
+
+    filenames = []
+    for i in range(12):
+        filename = tmp_path / f"plugin-x{i}-1.0.0.tar.gz"
+        filename.write_bytes(str(i).encode())
+        filenames.append(filename)
+    futures = []
+
+    class Executor(concurrent.futures.ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            futures.append(super().submit(*args, **kwargs))
+            return futures[-1]
+
+    monkeypatch.setattr(concurrent.futures, "ThreadPoolExecutor", Executor)
+    api = Api()
+    try:
+        with click.Context(click.Command("test"), obj={"silent": True}):
+            with pytest.raises(RuntimeError):
+                plugins._install_plugins(api, filenames, UploadedBlobsCache(tmp_path))
+        # The other workers are blocked, so the queued uploads were cancelled: at most
+        # 8 workers plus the reuse of the failed upload's worker can have started.
+        assert len(futures) == len(filenames)
+        cancelled = [str(fn) for fn, f in zip(filenames, futures) if f.cancelled()]
+        assert len(cancelled) >= len(filenames) - 9
+        assert not set(cancelled) & set(api.started)
+    finally:
+        release.set()
+
+
+def test_install_all_available_downloads_from_s3_together(local_store, monkeypatch):
+    keys = ["plugin-a-1.0.0.tar.gz", "plugin-b-2.0.0.tar.gz", "README.md"]
+    downloads, installs = [], []
+
+    def download_files(to_download):
+        downloads.append(list(to_download))
+        for bucket, name, target in to_download:
+            Path(target).write_bytes(name.encode())
+            yield None
+
+    def install_plugins(api, filenames, blobs, **kwargs):
+        installs.extend(filename.name for filename in filenames)
+        return True
+
+    monkeypatch.setattr(
+        s3, "list_buckets", lambda buckets: [("bucket", {"Key": k}) for k in keys]
+    )
+    monkeypatch.setattr(s3, "download_files", download_files)
+    monkeypatch.setattr(
+        PluginInfos, "make_from_encapsia", lambda host, bad=None: PluginInfos([])
+    )
+    monkeypatch.setattr(lib, "get_api", lambda **obj: object())
+    monkeypatch.setattr(plugins, "_install_plugins", install_plugins)
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        [
+            "plugins",
+            "--local-dir",
+            local_store.as_posix(),
+            "--s3-bucket",
+            "bucket",
+            "install",
+            "--all-available",
+            "--yes",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert len(downloads) == 1
+    assert sorted(name for bucket, name, target in downloads[0]) == keys[:2]
+    assert sorted(installs) == keys[:2]